@@ -1,41 +1,74 @@
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import csv
+import io
+import json
+import logging
 import os
 import sys
-from datetime import datetime, timedelta
 from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-def debug_print(message):
-    """Print debug messages that will show up in GitHub Actions logs."""
-    print(f"DEBUG: {message}", file=sys.stderr)
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 
-def parse_date(date_string):
-    """Convert API date format to readable format."""
-    try:
-        return datetime.strptime(date_string, '%Y-%m-%dT%H:%M:%S.%fZ').strftime('%B %d, %Y')
-    except ValueError:
-        return datetime.strptime(date_string, '%Y-%m-%dT%H:%M:%SZ').strftime('%B %d, %Y')
+# Shared session so every request reuses pooled keep-alive connections
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.3,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      respect_retry_after_header=False,
+                      raise_on_status=False)
+))
+
+# (connect, read) timeouts so one unresponsive host cannot stall the run
+API_TIMEOUT = (3.05, 30)
+URL_CHECK_TIMEOUT = (3.05, 10)
+
+logger = logging.getLogger(__name__)
+
+# Per-row debug lines go to a child logger that stays at INFO unless DEBUG_VERBOSE=1,
+# in which case it inherits the main logger's level; aggregates are always logged
+row_logger = logging.getLogger(__name__ + ".rows")
+row_logger.setLevel(logging.NOTSET if os.environ.get('DEBUG_VERBOSE') == '1' else logging.INFO)
+
+# Directory holding cached API responses and their validators
+CACHE_DIR = ".cache"
+
+# Asset types included in the coverage file
+RATE_TYPES = frozenset({'Reference_Rate', 'Benchmark_Reference_Rate'})
+
+# Translation table turning API short names into display names
+UNDERSCORE_TO_SPACE = str.maketrans('_', ' ')
+
+# Ticker suffix -> daily fixing location, in the preferred order for the
+# Dissemination(s) column; the name suffixes are derived from it
+LOCATION_SUFFIXES = {'_SGP': 'SGP', '_LDN': 'LDN', '_NYC': 'NYC'}
+LOCATION_ORDER = tuple(LOCATION_SUFFIXES.values())
+LOCATION_NAME_SUFFIXES = tuple(' ' + location for location in LOCATION_ORDER)
 
 def get_base_ticker(ticker):
     """Extract base ticker from location-based variants and remove trailing underscores."""
     # Remove trailing underscores first
     cleaned_ticker = ticker.rstrip('_')
     
-    # Remove location suffixes - need to check for _NYC, _LDN, _SGP
-    if cleaned_ticker.endswith('_NYC'):
-        return cleaned_ticker[:-4]  # Remove '_NYC'
-    elif cleaned_ticker.endswith('_LDN'):
-        return cleaned_ticker[:-4]  # Remove '_LDN'  
-    elif cleaned_ticker.endswith('_SGP'):
-        return cleaned_ticker[:-4]  # Remove '_SGP'
+    # Remove location suffixes (_NYC, _LDN, _SGP)
+    for suffix in LOCATION_SUFFIXES:
+        if cleaned_ticker.endswith(suffix):
+            return cleaned_ticker[:-len(suffix)]
     
     return cleaned_ticker
 
 def clean_name(name):
     """Remove location suffixes from name."""
     # Remove location suffixes from the end of names
-    for suffix in [' NYC', ' LDN', ' SGP']:
+    for suffix in LOCATION_NAME_SUFFIXES:
         if name.endswith(suffix):
             return name[:-len(suffix)]
     return name
@@ -50,15 +83,12 @@ def get_dissemination_type_from_ticker(ticker):
     """
     cleaned_ticker = ticker.rstrip('_')
     
-    if cleaned_ticker.endswith('_NYC'):
-        return 'daily_fixing', 'NYC'
-    elif cleaned_ticker.endswith('_LDN'):
-        return 'daily_fixing', 'LDN'
-    elif cleaned_ticker.endswith('_SGP'):
-        return 'daily_fixing', 'SGP'
-    else:
-        # Base ticker (no location suffix) = Real-time
-        return 'realtime', None
+    for suffix, location in LOCATION_SUFFIXES.items():
+        if cleaned_ticker.endswith(suffix):
+            return 'daily_fixing', location
+    
+    # Base ticker (no location suffix) = Real-time
+    return 'realtime', None
 
 def check_learn_more_url(ticker):
     """
@@ -67,18 +97,79 @@ def check_learn_more_url(ticker):
     """
     url = f"https://explorer.kaiko.com/rates/{ticker}"
     try:
-        debug_print(f"Checking URL status for {url}")
-        response = requests.head(url, timeout=10) 
+        row_logger.debug("Checking URL status for %s", url)
+        response = SESSION.head(url, timeout=URL_CHECK_TIMEOUT)
         if response.status_code == 200:
-            debug_print(f"✅ URL {url} is valid (200 OK)")
+            row_logger.debug("✅ URL %s is valid (200 OK)", url)
             return True
         else:
-            debug_print(f"❌ URL {url} returned status code {response.status_code}")
+            logger.debug("❌ URL %s returned status code %s", url, response.status_code)
             return False
     except Exception as e:
-        debug_print(f"🚨 Error checking URL {url}: {e}")
+        logger.debug("🚨 Error checking URL %s: %s", url, e)
         return False
 
+def check_learn_more_urls(tickers, max_workers=16):
+    """
+    Checks the 'Learn more' URLs for many tickers concurrently over the shared session.
+    Returns a list of booleans in the same order as the given tickers.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(check_learn_more_url, tickers))
+
+def write_file_atomic(path, content, mode="w", **open_kwargs):
+    """Write to a temporary file and rename it over path, so a crash never leaves a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, mode, **open_kwargs) as tmp_file:
+        tmp_file.write(content)
+    os.replace(tmp_path, path)
+
+def fetch_with_cache(url, cache_name):
+    """
+    GET a URL, revalidating an on-disk copy with ETag/Last-Modified.
+    Returns (status_code, content); a 304 is served from the cache as a 200.
+    """
+    body_path = os.path.join(CACHE_DIR, f"{cache_name}.body")
+    meta_path = os.path.join(CACHE_DIR, f"{cache_name}.meta.json")
+    
+    # Only send validators when the cached body they describe is present
+    request_headers = {}
+    cached_body = None
+    try:
+        with open(body_path, "rb") as body_file:
+            cached_body = body_file.read()
+        with open(meta_path, encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+        if meta.get('etag'):
+            request_headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            request_headers['If-Modified-Since'] = meta['last_modified']
+    except (FileNotFoundError, ValueError):
+        # Missing or unreadable cache entry: fetch without validators
+        pass
+    
+    response = SESSION.get(url, headers=request_headers, timeout=API_TIMEOUT)
+    
+    if response.status_code == 304 and request_headers:
+        logger.debug("♻️ %s not modified, using cached copy", url)
+        return 200, cached_body
+    
+    if response.status_code == 200:
+        logger.debug("%s Content-Encoding: %s", url, response.headers.get('Content-Encoding', 'identity'))
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            # Drop the old validators first so they never describe a newer body
+            try:
+                os.remove(meta_path)
+            except FileNotFoundError:
+                pass
+            write_file_atomic(body_path, response.content, "wb")
+            write_file_atomic(meta_path, json.dumps({'etag': etag, 'last_modified': last_modified}), encoding='utf-8')
+    
+    return response.status_code, response.content
+
 def merge_location_variants(items):
     """
     Merge location-based variants into single rows with combined disseminations.
@@ -86,37 +177,37 @@ def merge_location_variants(items):
     - Base ticker (no suffix) = Real-time
     - _NYC/_LDN/_SGP suffix = Daily Fixing for that location
     """
-    debug_print("Starting merge of location variants for single assets")
+    logger.debug("Starting merge of location variants for single assets")
     
     # Group items by base ticker
     ticker_groups = OrderedDict()
     
+    setdefault = ticker_groups.setdefault
+    
     for item in items:
         original_ticker = item[2]  # Original ticker is at index 2
         base_ticker = get_base_ticker(original_ticker)
         
-        debug_print(f"GROUPING: {original_ticker} -> base: {base_ticker}")
-        
-        if base_ticker not in ticker_groups:
-            ticker_groups[base_ticker] = []
+        row_logger.debug("GROUPING: %s -> base: %s", original_ticker, base_ticker)
         
-        ticker_groups[base_ticker].append(item)
+        setdefault(base_ticker, []).append(item)
     
-    debug_print(f"\nGROUPING SUMMARY:")
-    for base_ticker, variants in ticker_groups.items():
-        debug_print(f"  Base: {base_ticker} has {len(variants)} variants:")
-        for variant in variants:
-            debug_print(f"    - {variant[2]}")
+    if row_logger.isEnabledFor(logging.DEBUG):
+        summary_lines = ["\nGROUPING SUMMARY:"]
+        for base_ticker, variants in ticker_groups.items():
+            summary_lines.append(f"  Base: {base_ticker} has {len(variants)} variants:")
+            summary_lines.extend(f"    - {variant[2]}" for variant in variants)
+        row_logger.debug('\n'.join(summary_lines))
     
     merged_items = []
     
     # Process each group
     for base_ticker, variants in ticker_groups.items():
-        debug_print(f"\n=== PROCESSING: {base_ticker} with {len(variants)} variants ===")
+        row_logger.debug("\n=== PROCESSING: %s with %d variants ===", base_ticker, len(variants))
         
         # If only one variant, check if it should be merged anyway
         if len(variants) == 1:
-            debug_print(f"  Only one variant for {base_ticker}: {variants[0][2]}")
+            row_logger.debug("  Only one variant for %s: %s", base_ticker, variants[0][2])
         
         # Use first variant as template for name
         base_variant = variants[0]
@@ -131,35 +222,30 @@ def merge_location_variants(items):
             original_ticker = variant[2]
             dissem_type, location = get_dissemination_type_from_ticker(original_ticker)
             
-            debug_print(f"  Analyzing {original_ticker}: {dissem_type} {location or '(none)'}")
+            row_logger.debug("  Analyzing %s: %s %s", original_ticker, dissem_type, location or '(none)')
             
             if dissem_type == 'realtime':
                 has_realtime = True
-                debug_print(f"    -> Real-time found")
+                row_logger.debug("    -> Real-time found")
             elif dissem_type == 'daily_fixing' and location:
                 daily_fixing_locations.add(location)
-                debug_print(f"    -> Daily fixing {location} found")
+                row_logger.debug("    -> Daily fixing %s found", location)
         
         # Build dissemination string
         dissemination_parts = []
         
         if daily_fixing_locations:
-            # Sort locations in preferred order
-            location_order = ['SGP', 'LDN', 'NYC']
-            sorted_locations = [loc for loc in location_order if loc in daily_fixing_locations]
-            dissemination_parts.append(f"Daily Fixing {', '.join(sorted_locations)}")
+            # Join locations in preferred order
+            dissemination_parts.append(
+                "Daily Fixing " + ', '.join(loc for loc in LOCATION_ORDER if loc in daily_fixing_locations)
+            )
         
         if has_realtime:
             dissemination_parts.append("Real-time (5s)")
         
         combined_disseminations = ', '.join(dissemination_parts)
         
-        debug_print(f"    FINAL DISSEMINATION: {combined_disseminations}")
-        
-        # Check the 'Learn more' URL
-        if not check_learn_more_url(clean_base_ticker):
-            debug_print(f"🚫 Excluding {clean_base_ticker} - Learn more URL check failed")
-            continue
+        row_logger.debug("    FINAL DISSEMINATION: %s", combined_disseminations)
         
         # Create the 'Learn more' link
         learn_more_link = f'<a href="https://explorer.kaiko.com/rates/{clean_base_ticker}" target="_blank">Explore performance</a>'
@@ -174,71 +260,82 @@ def merge_location_variants(items):
         )
         
         merged_items.append(merged_entry)
-        debug_print(f"✅ CREATED ENTRY: {clean_base_ticker} -> {combined_disseminations}")
     
-    debug_print(f"\nFINAL RESULT: {len(merged_items)} merged entries from {len(items)} original items")
+    # Check the 'Learn more' URLs concurrently and drop entries that fail
+    url_checks = check_learn_more_urls([entry[2] for entry in merged_items])
+    for entry, is_valid in zip(merged_items, url_checks):
+        if is_valid:
+            row_logger.debug("✅ CREATED ENTRY: %s -> %s", entry[2], entry[3])
+        else:
+            logger.debug("🚫 Excluding %s - Learn more URL check failed", entry[2])
+    merged_items = [entry for entry, is_valid in zip(merged_items, url_checks) if is_valid]
+    
+    logger.debug("\nFINAL RESULT: %d merged entries from %d original items", len(merged_items), len(items))
     return merged_items
 
+def format_csv_rows(rows):
+    """Render rows to a single CSV string so the file is written in one call."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_MINIMAL)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
 def pull_and_save_data_to_csv(api_url, api_key):
     """Fetch single-asset reference rates and save them to CSV with screenshot columns only."""
-    debug_print("Starting data pull and save process (processing all records)")
+    logger.debug("Starting data pull and save process (processing all records)")
     
     headers = [
         'Family', 'Name', 'Base Ticker', 'Dissemination(s)', 'Learn more'
     ]
     
-    response = requests.get(api_url)
-    if response.status_code == 200:
-        data = json.loads(response.text)
-        api_items = []
+    status_code, content = fetch_with_cache(api_url, "rates")
+    if status_code == 200:
+        data = _loads(content)
         
         # Filter for USD quote items only
         usd_items = [item for item in data['data'] if item['quote']['short_name'].upper() == 'USD']
-        debug_print(f"Filtered to {len(usd_items)} USD quote items")
+        logger.debug("Filtered to %d USD quote items", len(usd_items))
         
-        for item in usd_items:
-            ticker = item['ticker']
-            asset_type = item['type']
-            
-            # Only process Reference_Rate and Benchmark_Reference_Rate
-            if asset_type not in ['Reference_Rate', 'Benchmark_Reference_Rate']:
-                continue
-            
-            short_name = item['short_name'].replace('_', ' ')
-            dissemination = item['dissemination']  # We'll ignore this and use ticker suffix instead
-            
-            debug_print(f"COLLECTING: {ticker} (API says: {dissemination})")
-            
-            api_items.append((
-                asset_type,
-                short_name,
-                ticker,
-                dissemination  # This will be ignored in favor of ticker-based logic
-            ))
+        # Only process Reference_Rate and Benchmark_Reference_Rate
+        api_items = [
+            (
+                item['type'],
+                item['short_name'].translate(UNDERSCORE_TO_SPACE),
+                item['ticker'],
+                item['dissemination']  # This will be ignored in favor of ticker-based logic
+            )
+            for item in usd_items
+            if item['type'] in RATE_TYPES
+        ]
         
-        debug_print(f"COLLECTED {len(api_items)} items for processing")
+        if row_logger.isEnabledFor(logging.DEBUG):
+            for row in api_items:
+                row_logger.debug("COLLECTING: %s (API says: %s)", row[2], row[3])
+        
+        logger.debug("COLLECTED %d items for processing", len(api_items))
         
         # Merge location variants
         merged_items = merge_location_variants(api_items)
         
         # Save to CSV
         main_csv_path = "Reference_Rates_Coverage.csv"
-        with open(main_csv_path, "w", newline='') as csv_file:
-            writer = csv.writer(csv_file, quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(headers)
-            writer.writerows(merged_items)
-        
-        print(f"\nSaved {len(merged_items)} merged records to {main_csv_path}")
+        write_file_atomic(main_csv_path, format_csv_rows([headers] + merged_items),
+                          newline='', encoding='utf-8')
         
-        # Print first few rows for verification
-        print("\nFirst 5 rows:")
-        for i, row in enumerate(merged_items[:5]):
-            print(f"{i+1}: {row[1]} ({row[2]}) -> {row[3]}")
+        # Print a summary and the first few rows for verification in one write
+        summary_lines = [f"\nSaved {len(merged_items)} merged records to {main_csv_path}", "\nFirst 5 rows:"]
+        summary_lines.extend(f"{i+1}: {row[1]} ({row[2]}) -> {row[3]}" for i, row in enumerate(merged_items[:5]))
+        print('\n'.join(summary_lines))
         
     else:
-        debug_print(f"❌ Error fetching API data: {response.status_code}")
+        logger.debug("❌ Error fetching API data: %s", status_code)
 
 # Main execution
 if __name__ == "__main__":
+    # Root stays at WARNING so urllib3 is quiet; the script's own debug output is on by
+    # default for the GitHub Actions logs (set LOG_LEVEL=INFO to skip it)
+    logging.basicConfig(format="%(levelname)s: %(message)s", stream=sys.stderr)
+    log_level = logging.getLevelName(os.environ.get("LOG_LEVEL", "DEBUG").upper())
+    logger.setLevel(log_level if isinstance(log_level, int) else logging.DEBUG)
     api_key = os.environ.get("KAIKO_API_KEY", "")
     pull_and_save_data_to_csv("https://us.market-api.kaiko.io/v2/data/index_reference_data.v1/rates", api_key)